@@ -71,6 +71,7 @@ async def oldrepocache(repocache):
     yield repocache
 
 
+@pytest.mark.network
 @pytest.mark.asyncio
 async def test_find_git_repo(repocache):
     git_cache = repocache / "git"
@@ -113,6 +114,7 @@ def anotherrepocache(tmpdir, header_for_git):
     yield gitcdn
 
 
+@pytest.mark.network
 def test_clean_repocache(mocker, anotherrepocache):
     mocker.patch(
         "git_cdn.cache_handler.clean_cache.must_clean", return_value=[True, True, False]
@@ -20,12 +20,41 @@ MANIFEST_PATH = f"{GITLAB_REPO_TEST_GROUP}/test_git_cdn.git"
 CREDS = os.getenv("CREDS", "gitlab-ci-token:{}".format(os.getenv("CI_JOB_TOKEN")))
 
 
+def pytest_addoption(parser):
+    parser.addoption(
+        "--thorough",
+        action="store_true",
+        default=False,
+        help="fully decode responses in tests instead of only scanning their bytes",
+    )
+
+
+@pytest_asyncio.fixture
+def thorough(request):
+    return request.config.getoption("--thorough")
+
+
 @pytest_asyncio.fixture
 def tmpworkdir(tmpdir):
     git_cdn.util.WORKDIR = tmpdir / "gitCDN"
     yield tmpdir
 
 
+@pytest_asyncio.fixture(scope="session")
+def warm_workdir_path(tmp_path_factory):
+    # tmp_path_factory is already per pytest-xdist worker
+    return tmp_path_factory.mktemp("warm_workdir")
+
+
+@pytest_asyncio.fixture
+def warm_workdir(warm_workdir_path):
+    """working directory shared by the tests of a session (per worker):
+    the first test populates the caches, the next ones find them warm
+    """
+    git_cdn.util.WORKDIR = warm_workdir_path
+    yield warm_workdir_path
+
+
 @pytest_asyncio.fixture
 def app(tmpworkdir):
     yield git_cdn_app.make_app(GITSERVER_UPSTREAM)
@@ -90,7 +119,8 @@ class FakeClient:
 
 @pytest_asyncio.fixture
 def header_for_git(request):
-    return ["-c", f"http.extraheader=X-CI-INTEG-TEST: {request.node.nodeid}"]
+    # function scoped, as the header identifies the running test on the upstream side
+    return ("-c", f"http.extraheader=X-CI-INTEG-TEST: {request.node.nodeid}")
 
 
 @pytest_asyncio.fixture
@@ -6,6 +6,7 @@ import re
 import time
 import traceback
 import uuid
+from collections import OrderedDict
 from concurrent.futures import CancelledError
 from multiprocessing import cpu_count
 from typing import Union
@@ -43,6 +44,33 @@ PROTOCOL_VERSION_RE = re.compile(r"^version=(\d+)$")
 RUNNING_LOOP = ""
 WORKER_PID = -1
 GUNICORN_WORKER_NB = int(os.getenv("GUNICORN_WORKER", "8"))
+# number of parsed upload-pack inputs kept, CI runners send the same clone bodies
+PARSE_CACHE_SIZE = int(os.getenv("UPLOAD_PACK_PARSE_CACHE_SIZE", "1024"))
+# bigger inputs (fetches with many haves) are seldom repeated, don't keep them
+PARSE_CACHE_MAX_INPUT = 4096
+
+
+_parse_cache = OrderedDict()
+
+
+def parse_upload_pack_input(parser_cls, content):
+    """parsed inputs are only read by the handlers, identical ones can be shared
+    inputs failing to parse are not kept: each of them is logged, and gets its own
+    random hash so that it is never served from the pack cache
+    """
+    if len(content) > PARSE_CACHE_MAX_INPUT:
+        return parser_cls(content)
+    key = (parser_cls, content)
+    parsed = _parse_cache.get(key)
+    if parsed is not None:
+        _parse_cache.move_to_end(key)
+        return parsed
+    parsed = parser_cls(content)
+    if not parsed.parse_error and PARSE_CACHE_SIZE > 0:
+        _parse_cache[key] = parsed
+        if len(_parse_cache) > PARSE_CACHE_SIZE:
+            _parse_cache.popitem(last=False)
+    return parsed
 
 
 def fix_response_headers(headers):
@@ -397,7 +425,9 @@ class GitCDN:
         """
         request_content = await request.content.read()
         if protocol_version == 2:
-            parsed_content = UploadPackInputParserV2(request_content)
+            parsed_content = parse_upload_pack_input(
+                UploadPackInputParserV2, request_content
+            )
             if parsed_content.command != b"fetch":
                 bind_contextvars(
                     upload_pack_status="direct",
@@ -408,7 +438,9 @@ class GitCDN:
                 return await self.proxify_with_data(request, request_content)
             bind_contextvars(command="fetch")
         else:
-            parsed_content = UploadPackInputParser(request_content)
+            parsed_content = parse_upload_pack_input(
+                UploadPackInputParser, request_content
+            )
 
         bind_contextvars(upload_pack_status="direct", canceled=False)
         response = None
@@ -1,10 +1,10 @@
 import asyncio
 import fcntl
-import json
 import os
 import time
 from urllib.parse import urlparse
 
+import ujson
 from aiohttp import web
 from aiohttp.web_exceptions import HTTPNotFound
 from structlog import getLogger
@@ -16,6 +16,9 @@ from git_cdn.util import get_subdir
 
 log = getLogger()
 
+# write buffer size when storing a downloaded lfs object
+WRITE_BUFFER_SIZE = int(os.getenv("LFS_WRITE_BUFFER_SIZE", str(64 * 1024)))
+
 
 class LFSCacheFile:
     def __init__(self, href, headers):
@@ -156,7 +159,7 @@ class LFSCacheFile:
                 ctx["lfs_content_encoding"] = "gzip"
                 ext = ".gzip"
 
-            with open(self.filename + ext, "wb") as f:
+            with open(self.filename + ext, "wb", buffering=WRITE_BUFFER_SIZE) as f:
                 try:
                     while chunk := await request.content.readany():
                         f.write(chunk)
@@ -203,7 +206,7 @@ class LFSCacheManager:
 
     async def hook_lfs_batch(self, lfs_result_content):
         """modify the lfs batch result to change the hrefs so that they point to us"""
-        js = json.loads(lfs_result_content)
+        js = ujson.loads(lfs_result_content)
         if "objects" not in js:
             return lfs_result_content
         for o in js["objects"]:
@@ -217,7 +220,7 @@ class LFSCacheManager:
                         self.upstream_url, self.base_url
                     )
 
-        return json.dumps(js).encode()
+        return ujson.dumps(js, escape_forward_slashes=False).encode()
 
     async def get_from_cache(self, href, headers):
         """@returns: filename where to find the file
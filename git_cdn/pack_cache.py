@@ -8,6 +8,7 @@ from time import time
 
 # Third Party Libraries
 from aiohttp.abc import AbstractStreamWriter
+from aiohttp.http_writer import StreamWriter
 from structlog import getLogger
 from structlog.contextvars import bind_contextvars
 
@@ -21,6 +22,8 @@ executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
 
 # chunk size when reading the cache file
 CHUNK_SIZE = int(os.getenv("PACK_CACHE_CHUNK_SIZE", str(1024 * 1024)))
+# extended attribute holding the size of a completely written pack cache file
+VALID_XATTR = "user.gitcdn.valid"
 
 
 class PackCache:
@@ -46,18 +49,69 @@ class PackCache:
         os.unlink(self.filename)
 
     def exists(self):
-        if os.path.exists(self.filename) and os.stat(self.filename).st_size > 0:
+        try:
+            size = os.stat(self.filename).st_size
+        except FileNotFoundError:
+            return False
+        if size == 0:
+            return False
+        try:
+            # fast path: the size recorded when the file was completed tells
+            # whether it is still whole, without opening it
+            valid_size = int(os.getxattr(self.filename, VALID_XATTR))
+        except (OSError, ValueError):
+            # no such attribute or filesystem without xattr support
+            valid_size = None
+        if valid_size is not None:
+            if valid_size == size:
+                return True
+        else:
             with open(self.filename, "rb") as f:
                 f.seek(-4, os.SEEK_END)
                 last_chunk = f.read(4)
                 if last_chunk == b"0000":
                     return True
-                log.warning("File in cache is corrupted", hash=self.hash)
+        log.warning("File in cache is corrupted", hash=self.hash)
         return False
 
     def size(self):
         return os.stat(self.filename).st_size
 
+    async def _sendfile(self, writer, f):
+        """send the whole cache file with sendfile(2), avoiding the copies to userspace
+
+        This is only possible with aiohttp's own writer, without compression,
+        on a stdlib event loop (uvloop doesn't implement loop.sendfile).
+        As the writer is bypassed, the chunked encoding framing is done here.
+        returns the number of bytes sent, the file position is moved accordingly
+        """
+        loop = asyncio.get_running_loop()
+        if (
+            not isinstance(loop, asyncio.BaseEventLoop)
+            or not isinstance(writer, StreamWriter)
+            or writer._compress is not None  # pylint: disable=protected-access
+            or writer.transport is None
+        ):
+            return 0
+        if hasattr(writer, "send_headers"):
+            # recent aiohttp versions hold back the headers until the first body write
+            writer.send_headers()
+        size = self.size()
+        if writer.chunked:
+            writer.transport.write(f"{size:x}\r\n".encode())
+        try:
+            sent = await loop.sendfile(writer.transport, f, 0, size)
+        except ConnectionResetError:
+            log.warning("connection reset while serving pack cache")
+            # the file position tells how much was sent, skip the chunks copy
+            sent = f.tell()
+            f.seek(0, os.SEEK_END)
+            return sent
+        if writer.chunked:
+            writer.transport.write(b"\r\n")
+        writer.output_size += sent
+        return sent
+
     async def send_pack(self, writer):
         status = "hit" if self.hit else "miss"
         bind_contextvars(
@@ -69,6 +123,8 @@ class PackCache:
         with open(self.filename, "rb") as f:
             count = 0
             try:
+                # when sendfile is not possible, fall back to copying chunks
+                count = await self._sendfile(writer, f)
                 while True:
                     data = f.read(CHUNK_SIZE)
                     count += len(data)
@@ -100,15 +156,33 @@ class PackCache:
         # update mtime for LRU
         os.utime(self.filename, None)
 
+    def _mark_valid(self, size):
+        try:
+            os.setxattr(self.filename, VALID_XATTR, str(size).encode())
+        except OSError:
+            # not supported by the filesystem, exists() will check the file content
+            pass
+
+    def _unmark_valid(self):
+        try:
+            os.removexattr(self.filename, VALID_XATTR)
+        except OSError:
+            # no such file or attribute, or no xattr support
+            pass
+
     async def cache_pack(self, read_func, stream_writer: AbstractStreamWriter = None):
         log.debug("Cache Miss, create new cache entry", hash=self.hash)
         self.hit = False
         pkt_parser = PacketLineChunkParser(read_func)
         end_with_error = False
+        # a file rewritten in place keeps its extended attributes: drop the
+        # mark first, so a partial rewrite is never taken for a valid pack
+        self._unmark_valid()
         with open(self.filename, "wb") as f:
             try:
                 async for data in pkt_parser:
                     f.write(data)
+                size = f.tell()
 
             except Exception as e:
                 log.error(
@@ -119,7 +193,10 @@ class PackCache:
                 )
                 end_with_error = True
 
-        if end_with_error:
+        if not end_with_error:
+            # the file is closed, hence flushed: mark it as complete
+            self._mark_valid(size)
+        else:
             # In case of error, we directly write the data to the stream writer
             # This will allow the client to receive the initial error reponse.
             if stream_writer:
@@ -140,11 +217,14 @@ class PackCacheCleaner:
         self.lock = FileLock(os.path.join(self.cache_dir, "clean.lock"))
 
     def _clean_task(self):
-        # When using os.scandir, DirEntry.stat() are cached (on Linux) and calling it
-        # doesn't go through syscall
-        subdirs = [d for d in os.scandir(self.cache_dir) if d.is_dir()]
-        subdirs = [os.path.join(self.cache_dir, sub) for sub in subdirs]
-        all_files = [f for sub in subdirs for f in os.scandir(sub) if f.is_file()]
+        # When using os.scandir, is_dir()/is_file() come from the directory listing
+        # (on Linux) and DirEntry.stat() is cached, so each file is stat'ed only once
+        all_files = []
+        with os.scandir(self.cache_dir) as subdirs:
+            for sub in subdirs:
+                if sub.is_dir():
+                    with os.scandir(sub.path) as entries:
+                        all_files.extend(f for f in entries if f.is_file())
         total_size = sum(f.stat().st_size for f in all_files)
         log.debug(
             "Pack Cache size is",
@@ -1,8 +1,11 @@
 import asyncio
 import fcntl
+import functools
 import os
+import sys
 import time
 from concurrent.futures import CancelledError
+from shutil import rmtree
 
 from aiohttp.web_exceptions import HTTPInternalServerError
 from aiohttp.web_exceptions import HTTPUnauthorized
@@ -21,13 +24,29 @@ log = getLogger()
 BACKOFF_START = float(os.getenv("BACKOFF_START", "0.5"))
 BACKOFF_COUNT = int(os.getenv("BACKOFF_COUNT", "5"))
 PROGRESS_OPTION = os.getenv("GIT_PROGRESS_OPTION", "--progress")
+# bytes of git outputs kept in the logs
+LOG_OUTPUT_SIZE = 128
+# shutil.rmtree error callback argument, onerror is deprecated since python 3.12
+RMTREE_ERROR_ARG = "onexc" if sys.version_info >= (3, 12) else "onerror"
+
+
+def log_rmtree_error(func, path, exc):
+    # onerror (python < 3.12) passes an exc_info tuple, onexc the exception
+    if isinstance(exc, tuple):
+        exc = exc[1]
+    log.error(
+        "failed to remove a file of the repository",
+        func=func.__name__,
+        path=os.fsdecode(path),
+        error=str(exc),
+    )
 
 
-async def exec_git(*args):
+async def exec_git(*args, stdout=asyncio.subprocess.PIPE):
     return await asyncio.create_subprocess_exec(
         "git",
         *args,
-        stdout=asyncio.subprocess.PIPE,
+        stdout=stdout,
         stderr=asyncio.subprocess.PIPE,
     )
 
@@ -58,9 +77,16 @@ class RepoCache:
     def write_lock(self):
         return lock(self.lock, mode=fcntl.LOCK_EX)
 
-    async def run_git(self, *args):
+    def hide_auth(self, data):
+        if not self.auth:
+            return data
+        auth = self.auth.encode()
+        return data.replace(auth, auth[:2] + b"<XX>")
+
+    async def run_git(self, *args, capture_stdout=True):
         """utility which runs a git command, and log outputs
         return stdout, stderr, returncode  via deferred
+        stdout is empty when not captured
         """
         t1 = time.time()
 
@@ -68,7 +94,14 @@ class RepoCache:
         stdout_data = b""
         stderr_data = b""
         try:
-            git_proc = await exec_git(*args)
+            git_proc = await exec_git(
+                *args,
+                stdout=(
+                    asyncio.subprocess.PIPE
+                    if capture_stdout
+                    else asyncio.subprocess.DEVNULL
+                ),
+            )
             stdout_data, stderr_data = await git_proc.communicate()
         except (
             asyncio.CancelledError,
@@ -80,23 +113,20 @@ class RepoCache:
             stdout_data, stderr_data = await git_proc.communicate()
             raise
         finally:
+            stdout_data = stdout_data or b""
             await ensure_proc_terminated(git_proc, str(args))
-            # prevent logging of the creds
-            if self.auth:
-                stdout_data = stdout_data.replace(
-                    self.auth.encode(), self.auth.encode()[:2] + b"<XX>"
-                )
-                stderr_data = stderr_data.replace(
-                    self.auth.encode(), self.auth.encode()[:2] + b"<XX>"
-                )
+            # prevent logging of the creds, stderr ends up in http errors
+            # (clone and fetch, the commands with big outputs, don't capture stdout)
+            stdout_data = self.hide_auth(stdout_data)
+            stderr_data = self.hide_auth(stderr_data)
             if b"HTTP Basic: Access denied" in stderr_data:
                 raise HTTPUnauthorized(reason=stderr_data)
 
             log.debug(
                 "git_cmd done",
                 cmd=args,
-                stdout_data=stdout_data.decode(errors="replace")[:128],
-                stderr_data=stderr_data.decode(errors="replace")[:128],
+                stdout_data=stdout_data[:LOG_OUTPUT_SIZE].decode(errors="replace"),
+                stderr_data=stderr_data[:LOG_OUTPUT_SIZE].decode(errors="replace"),
                 rc=git_proc.returncode,
                 pid=git_proc.pid,
                 cmd_duration=time.time() - t1,
@@ -116,6 +146,7 @@ class RepoCache:
                 "--tags",
                 self.url,
                 "+refs/*:refs/remotes/origin/*",
+                capture_stdout=False,
             )
             if returncode == 0:
                 break
@@ -130,7 +161,12 @@ class RepoCache:
                 async with lock(bundle_lock, mode=fcntl.LOCK_SH):
                     # try to clone the bundle file instead
                     _, stderr, returncode = await self.run_git(
-                        "clone", PROGRESS_OPTION, "--bare", bundle_file, self.directory
+                        "clone",
+                        PROGRESS_OPTION,
+                        "--bare",
+                        bundle_file,
+                        self.directory,
+                        capture_stdout=False,
                     )
                     if returncode == 0:
                         break
@@ -138,18 +174,20 @@ class RepoCache:
                     os.unlink(bundle_file)
 
             if self.exists():
-                rm_proc = await asyncio.create_subprocess_exec(
-                    "rm",
-                    "-rf",
-                    self.directory,
-                    stdout=asyncio.subprocess.PIPE,
-                    stderr=asyncio.subprocess.PIPE,
-                )
-                await ensure_proc_terminated(
-                    rm_proc, f"rm -rf {self.directory}", timeout=3600
+                # remove the leftovers of the failed clone, without blocking the loop
+                await asyncio.get_running_loop().run_in_executor(
+                    None,
+                    functools.partial(
+                        rmtree, self.directory, **{RMTREE_ERROR_ARG: log_rmtree_error}
+                    ),
                 )
             _, stderr, returncode = await self.run_git(
-                "clone", PROGRESS_OPTION, "--bare", self.url, self.directory
+                "clone",
+                PROGRESS_OPTION,
+                "--bare",
+                self.url,
+                self.directory,
+                capture_stdout=False,
             )
             if returncode == 0:
                 break
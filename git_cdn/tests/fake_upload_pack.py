@@ -0,0 +1,42 @@
+# Standard Library
+import os
+import sys
+
+# Third Party Libraries
+from git_cdn.packet_line import PacketLineParser
+from git_cdn.packet_line import to_packet
+
+# stand-in for "git-upload-pack --stateless-rpc <dir>" used to test the pkt-line
+# pipeline without a repository: answers a canned pack for the commits below,
+# and "not our ref" like git does for any other want
+
+KNOWN_COMMITS = {
+    b"4284b1521b200ba4934ee710a4a538549f1f0f97",
+    b"8f6312ec029e7290822bed826a05fd81e65b3b7c",
+}
+
+FAKE_PACK = to_packet(b"PACK fake pack content\n", channel=1)
+
+
+def main():
+    data = sys.stdin.buffer.read()
+    for pkt in PacketLineParser(data):
+        # flush and delim (v2) packets are markers, not bytes
+        if not isinstance(pkt, bytes) or not pkt.startswith(b"want "):
+            continue
+        want = pkt[5:45]
+        if want not in KNOWN_COMMITS:
+            error = b"upload-pack: not our ref " + want
+            sys.stdout.buffer.write(to_packet(b"ERR " + error))
+            sys.stderr.buffer.write(b"fatal: git " + error + b"\n")
+            return 128
+    if os.getenv("GIT_PROTOCOL") == "version=2":
+        # no acknowledgments section for a clone: the packfile section comes first
+        sys.stdout.buffer.write(b"000dpackfile\n" + FAKE_PACK + b"0000")
+    else:
+        sys.stdout.buffer.write(b"0008NAK\n" + FAKE_PACK + b"0000")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -69,13 +69,17 @@ async def monkey():
 async def cancel_monkey(tasks):
     if sys.argv[1] == "False":
         return
+    # draw the cancellation order once, then cancel from the end of the list
+    random.shuffle(tasks)
     for _ in range(3000):
+        if not tasks:
+            # everything is cancelled, no need to keep sleeping
+            break
         await sleep(random.random() / 1000)
         if random.random() > 0.9:
-            if tasks:
-                t = tasks.pop(random.randint(0, len(tasks) - 1))
-                print("cancelling", id(t), len(tasks))
-                t.cancel()
+            t = tasks.pop()
+            print("cancelling", id(t), len(tasks))
+            t.cancel()
 
 
 async def main():
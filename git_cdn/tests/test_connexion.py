@@ -15,6 +15,8 @@ from git_cdn.conftest import MANIFEST_PATH
 # pylint: disable=redefined-outer-name,unused-argument
 
 
+# the retried request reaches the upstream server
+@pytest.mark.network
 @pytest.mark.asyncio
 async def test_proxy_retry_connection_issue(make_client, cdn_event_loop, app, mocker):
     assert cdn_event_loop
@@ -42,6 +44,8 @@ async def test_proxy_retry_connection_issue(make_client, cdn_event_loop, app, mo
     assert called == 1
 
 
+# the retried request reaches the upstream server
+@pytest.mark.network
 @pytest.mark.asyncio
 async def test_proxy_retry_answer_issue(make_client, cdn_event_loop, app, mocker):
     assert cdn_event_loop
@@ -1,12 +1,15 @@
 # Standard Library
+import asyncio
 import gzip
 import hashlib
 import json
-from copy import deepcopy
+import threading
+from pathlib import Path
 
 # Third Party Libraries
 import pytest
 import pytest_asyncio
+from aiohttp import ClientSession
 from aiohttp import web
 from aiohttp.web_exceptions import HTTPNotFound
 
@@ -15,6 +18,11 @@ from git_cdn.lfs_cache_manager import LFSCacheManager
 
 # pylint: disable=unused-argument,protected-access,redefined-outer-name,broad-exception-raised
 
+TEXT = "Hello, world"
+TEXT_BYTES = TEXT.encode()
+CHECKSUM = hashlib.sha256(TEXT_BYTES).hexdigest()
+PATH = f"/{CHECKSUM}"
+
 
 @pytest_asyncio.fixture
 def cache_manager(tmpworkdir):
@@ -23,225 +31,201 @@ def cache_manager(tmpworkdir):
     return c
 
 
-DOWNLOAD_RESPONSE = {
-    "transfer": "basic",
-    "objects": [
-        {
-            "oid": "1111111",
-            "size": 123,
-            "authenticated": True,
-            "actions": {
-                "download": {
-                    "href": "https://upstream/1111111",
-                    "header": {"Key": "value"},
-                    "expires_at": "2016-11-10T15:29:07Z",
-                }
-            },
+@pytest.fixture(scope="module")
+def lfs_server():
+    """serve all the download tests of the module from a single app
+
+    the server runs on its own loop in a thread, so that it outlives the
+    per test loops. tests register their handler in the returned dict,
+    keyed by url path
+    """
+    routes = {}
+
+    async def dispatch(request):
+        return await routes[request.path](request)
+
+    app = web.Application()
+    app.router.add_get("/{path:.*}", dispatch)
+    runner = web.AppRunner(app)
+    loop = asyncio.new_event_loop()
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    thread = threading.Thread(target=loop.run_forever, daemon=True)
+    thread.start()
+
+    yield routes, f"http://127.0.0.1:{port}"
+
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+    thread.join()
+    loop.close()
+
+
+@pytest_asyncio.fixture
+async def lfs_routes(cache_manager, lfs_server):
+    routes, url = lfs_server
+    routes.clear()
+    async with ClientSession(base_url=url, auto_decompress=False) as session:
+        cache_manager.session = session
+        yield routes
+
+
+def _make_response(with_objects=True, with_actions=True):
+    """build a fresh lfs batch response, so that tests can't alter each other's"""
+    response = {"transfer": "basic"}
+    if not with_objects:
+        return response
+    obj = {"oid": "1111111", "size": 123, "authenticated": True}
+    if with_actions:
+        obj["actions"] = {
+            "download": {
+                "href": "https://upstream/1111111",
+                "header": {"Key": "value"},
+                "expires_at": "2016-11-10T15:29:07Z",
+            }
         }
-    ],
-}
+    response["objects"] = [obj]
+    return response
 
 
 @pytest.mark.asyncio
 async def test_hook_lfs_batch(cache_manager, cdn_event_loop):
-    content = json.dumps(DOWNLOAD_RESPONSE)
+    content = json.dumps(_make_response())
     content = await cache_manager.hook_lfs_batch(content)
     exp = (
-        b'{"transfer": "basic", "objects": [{"oid": "1111111", "size": 123,'
-        b' "authenticated": true, "actions": {"download": {"href": "http://base/1111111",'
-        b' "header": {"Key": "value"}, "expires_at": "2016-11-10T15:29:07Z"}}}]}'
+        b'{"transfer":"basic","objects":[{"oid":"1111111","size":123,'
+        b'"authenticated":true,"actions":{"download":{"href":"http://base/1111111",'
+        b'"header":{"Key":"value"},"expires_at":"2016-11-10T15:29:07Z"}}}]}'
     )
     assert content == exp
 
 
 @pytest.mark.asyncio
 async def test_hook_lfs_batch_no_object(cache_manager, cdn_event_loop):
-    response = DOWNLOAD_RESPONSE.copy()
-    del response["objects"]
-    content = json.dumps(response)
+    content = json.dumps(_make_response(with_objects=False))
     content = await cache_manager.hook_lfs_batch(content)
     assert content == '{"transfer": "basic"}'
 
 
 @pytest.mark.asyncio
 async def test_hook_lfs_batch_no_action(cache_manager, cdn_event_loop):
-    response = deepcopy(DOWNLOAD_RESPONSE)
-    del response["objects"][0]["actions"]
-    content = json.dumps(response)
+    content = json.dumps(_make_response(with_actions=False))
     content = await cache_manager.hook_lfs_batch(content)
     assert content == (
-        b'{"transfer": "basic", "objects": [{"oid": "1111111",'
-        b' "size": 123, "authenticated": true}]}'
+        b'{"transfer":"basic","objects":[{"oid":"1111111",'
+        b'"size":123,"authenticated":true}]}'
     )
 
 
 @pytest.mark.asyncio
-async def test_download_gzip(cache_manager, tmpworkdir, cdn_event_loop, aiohttp_client):
-    TEXT = "Hello, world"
-    ZTEXT = gzip.compress(TEXT.encode())
+async def test_download_gzip(cache_manager, tmpworkdir, cdn_event_loop, lfs_routes):
+    ZTEXT = gzip.compress(TEXT_BYTES)
 
     async def hello(request):
         return web.Response(body=ZTEXT, headers={"Content-Encoding": "gzip"})
 
-    app = web.Application()
-
-    # build the checksum of our file
-    checksum = hashlib.sha256(TEXT.encode()).hexdigest()
-    path = f"/{checksum}"
-    app.add_routes([web.get(path, hello)])
-    client = await aiohttp_client(app, auto_decompress=False)
-    cache_manager.session = client
-    fn = LFSCacheFile(checksum, headers={"Accept-Encoding": "gzip"})
-    fn.filename = str(tmpworkdir / checksum)
-    fn.hash = checksum
+    lfs_routes[PATH] = hello
+    fn = LFSCacheFile(PATH, headers={"Accept-Encoding": "gzip"})
+    fn.filename = str(tmpworkdir / CHECKSUM)
+    fn.hash = CHECKSUM
     ctx = {}
 
     await fn.download(cache_manager.session, ctx)
-    with open(fn.filename) as f:
-        assert f.read() == TEXT
+    assert Path(fn.filename).read_bytes() == TEXT_BYTES
 
 
 @pytest.mark.asyncio
-async def test_download(cache_manager, tmpworkdir, cdn_event_loop, aiohttp_client):
-    TEXT = "Hello, world"
+async def test_download(cache_manager, tmpworkdir, cdn_event_loop, lfs_routes):
 
     async def hello(request):
         return web.Response(text=TEXT)
 
-    app = web.Application()
-
-    # build the checksum of our file
-    checksum = hashlib.sha256(TEXT.encode()).hexdigest()
-    path = f"/{checksum}"
-    app.add_routes([web.get(path, hello)])
-    client = await aiohttp_client(app)
-    cache_manager.session = client
-    fn = LFSCacheFile(checksum, headers={})
-    fn.filename = str(tmpworkdir / checksum)
-    fn.hash = checksum
+    lfs_routes[PATH] = hello
+    fn = LFSCacheFile(PATH, headers={})
+    fn.filename = str(tmpworkdir / CHECKSUM)
+    fn.hash = CHECKSUM
     ctx = {}
 
     await fn.download(cache_manager.session, ctx)
-    with open(fn.filename) as f:
-        assert f.read() == TEXT
+    assert Path(fn.filename).read_bytes() == TEXT_BYTES
 
 
 @pytest.mark.asyncio
 async def test_download_bad_checksum(
-    cache_manager, tmpworkdir, cdn_event_loop, aiohttp_client
+    cache_manager, tmpworkdir, cdn_event_loop, lfs_routes
 ):
-    TEXT = "Hello, world"
 
     async def hello(request):
         return web.Response(text=TEXT)
 
-    app = web.Application()
-
     path = "/xx"
-    app.add_routes([web.get(path, hello)])
-    client = await aiohttp_client(app)
-    cache_manager.session = client
+    lfs_routes[path] = hello
     with pytest.raises(HTTPNotFound):
         await cache_manager.get_from_cache(path, {})
 
 
 @pytest.mark.asyncio
 async def test_download_cache_miss(
-    cache_manager, tmpworkdir, cdn_event_loop, aiohttp_client
+    cache_manager, tmpworkdir, cdn_event_loop, lfs_routes
 ):
-    TEXT = "Hello, world"
 
     async def hello(request):
         return web.Response(text=TEXT)
 
-    app = web.Application()
-
-    # build the checksum of our file
-    checksum = hashlib.sha256(TEXT.encode()).hexdigest()
-    path = f"/{checksum}"
-    app.add_routes([web.get(path, hello)])
-    client = await aiohttp_client(app)
-    cache_manager.session = client
-    resp = await cache_manager.get_from_cache(path, {})
+    lfs_routes[PATH] = hello
+    resp = await cache_manager.get_from_cache(PATH, {})
     assert resp.body._value.read().decode() == TEXT
 
 
 @pytest.mark.asyncio
 async def test_download_cache_hit(
-    cache_manager, tmpworkdir, cdn_event_loop, aiohttp_client
+    cache_manager, tmpworkdir, cdn_event_loop, lfs_routes
 ):
-    TEXT = "Hello, world"
 
     async def hello(request):
         # we should not download in that case
         raise Exception("nope")
 
-    app = web.Application()
-
-    # build the checksum of our file
-    checksum = hashlib.sha256(TEXT.encode()).hexdigest()
-    path = f"/{checksum}"
-    app.add_routes([web.get(path, hello)])
-    client = await aiohttp_client(app)
-    cache_manager.session = client
+    lfs_routes[PATH] = hello
 
-    cache_file = LFSCacheFile(path, headers={})
+    cache_file = LFSCacheFile(PATH, headers={})
     async with cache_file.write_lock():
-        with open(cache_file.filename, "wb") as f:
-            f.write(TEXT.encode())
+        Path(cache_file.filename).write_bytes(TEXT_BYTES)
 
-    resp = await cache_manager.get_from_cache(path, {})
+    resp = await cache_manager.get_from_cache(PATH, {})
 
     assert resp.body._value.read().decode() == TEXT
 
 
 @pytest.mark.asyncio
 async def test_download_cache_being_written(
-    cache_manager, tmpworkdir, cdn_event_loop, aiohttp_client
+    cache_manager, tmpworkdir, cdn_event_loop, lfs_routes
 ):
-    TEXT = "Hello, world"
 
     async def hello(request):
         # we should not download in that case
         raise Exception("nope")
 
-    app = web.Application()
-
-    # build the checksum of our file
-    checksum = hashlib.sha256(TEXT.encode()).hexdigest()
-    path = f"/{checksum}"
-    app.add_routes([web.get(path, hello)])
-    client = await aiohttp_client(app)
-    cache_manager.session = client
-    cache_file = LFSCacheFile(path, headers={})
+    lfs_routes[PATH] = hello
+    cache_file = LFSCacheFile(PATH, headers={})
     async with cache_file.write_lock():
-        coroutine = cache_manager.get_from_cache(path, {})
-        with open(cache_file.filename, "wb") as f:
-            f.write(TEXT.encode())
+        coroutine = cache_manager.get_from_cache(PATH, {})
+        Path(cache_file.filename).write_bytes(TEXT_BYTES)
 
     # no we have release the lock, we wait for the coroutine
     await coroutine
-    with open(cache_file.filename) as f:
-        assert f.read() == TEXT
+    assert Path(cache_file.filename).read_bytes() == TEXT_BYTES
 
 
 @pytest.mark.asyncio
-async def test_download_error(
-    cache_manager, tmpworkdir, cdn_event_loop, aiohttp_client
-):
-    TEXT = "Hello, world"
+async def test_download_error(cache_manager, tmpworkdir, cdn_event_loop, lfs_routes):
 
     async def hello(request):
         # we should not download in that case
         raise HTTPNotFound()
 
-    app = web.Application()
-
-    # build the checksum of our file
-    checksum = hashlib.sha256(TEXT.encode()).hexdigest()
-    path = f"/{checksum}"
-    app.add_routes([web.get(path, hello)])
-    client = await aiohttp_client(app)
-    cache_manager.session = client
+    lfs_routes[PATH] = hello
     with pytest.raises(HTTPNotFound):
-        await cache_manager.get_from_cache(path, {})
+        await cache_manager.get_from_cache(PATH, {})
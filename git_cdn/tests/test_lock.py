@@ -1,5 +1,6 @@
 # Standard Library
 import asyncio
+import collections
 import fcntl
 import os
 import sys
@@ -16,23 +17,25 @@ from git_cdn.lock.aio_lock import lock
 # pylint: disable=unused-argument
 
 
-execution = []
+VERBOSE = os.getenv("GITCDN_TEST_VERBOSE", "false").lower() in ["true", "1"]
+execution = collections.deque()
 
 
 def log(s):
-    print(s)
+    if VERBOSE:
+        print(s)
     execution.append(s)
 
 
 def reset_log():
-    global execution
-    execution = []
+    execution.clear()
 
 
 async def release_promises(*promises):
     for p in promises:
         p.set_result(None)
-        await sleep(0.1)
+        # yield to the event loop so that waiters get scheduled, no need for wall time
+        await sleep(0)
 
 
 async def locking_coroutine(filename, mode, done, task_id):
@@ -86,7 +89,6 @@ async def test_lock_ex_sh_sh(tmpdir, cdn_event_loop):
     task3 = locking_coroutine(fn, fcntl.LOCK_SH, p3, 3)
 
     await gather(task1, task2, task3, release_promises(p1, p3, p2))
-    print(execution)
 
 
 @pytest.mark.parametrize("wait_time", [0, 0.1, 0.01, 0.001, 0.0001, 0.00001])
@@ -108,7 +110,6 @@ async def test_lock_ex_sh_cancel_wait(tmpdir, cdn_event_loop, wait_time):
         p2.set_result(None)
 
     await gather(task1, task2, release_all(), return_exceptions=True)
-    print(execution)
 
 
 # @pytest.mark.skip()
@@ -117,15 +118,22 @@ async def test_lock_ex_sh_cancel_wait(tmpdir, cdn_event_loop, wait_time):
 @pytest.mark.asyncio
 async def test_monkey_lock(tmpdir, cdn_event_loop, num_times, with_cancel_monkey):
     monkey = os.path.join(os.path.dirname(__file__), "lock_monkey.py")
-    dl = []
-    for _ in range(num_times):
-        proc = await asyncio.create_subprocess_exec(
-            sys.executable,
-            monkey,
-            str(with_cancel_monkey),
-            cwd=str(tmpdir),
-            stdin=asyncio.subprocess.PIPE,
-        )
-        dl.append(proc.wait())
-    rets = await asyncio.gather(*dl, return_exceptions=True)
+    # bound the number of monkeys running at once to avoid fork storms on CI,
+    # keeping at least two so that they still contend for the locks
+    sema = asyncio.Semaphore(max(os.cpu_count() or 1, 2))
+
+    async def run():
+        async with sema:
+            proc = await asyncio.create_subprocess_exec(
+                sys.executable,
+                monkey,
+                str(with_cancel_monkey),
+                cwd=str(tmpdir),
+                stdin=asyncio.subprocess.DEVNULL,
+                # monkeys are chatty, only keep stderr to see failures
+                stdout=None if VERBOSE else asyncio.subprocess.DEVNULL,
+            )
+            return await proc.wait()
+
+    rets = await gather(*[run() for _ in range(num_times)], return_exceptions=True)
     assert rets == [0] * num_times
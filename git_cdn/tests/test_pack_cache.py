@@ -1,11 +1,17 @@
 # Standard Library
 import asyncio
+import functools
 import os
 from time import time
 
 import pytest
+import uvloop
+from aiohttp import web
+from aiohttp.test_utils import TestClient
+from aiohttp.test_utils import TestServer
 
 # Third Party Libraries
+from git_cdn.pack_cache import VALID_XATTR
 from git_cdn.pack_cache import PackCache
 from git_cdn.pack_cache import PackCacheCleaner
 from git_cdn.tests.test_packet_line import DataReader
@@ -14,15 +20,21 @@ from git_cdn.tests.test_upload_pack import FakeStreamWriter
 # pylint: disable=unused-argument,redefined-builtin
 
 
+@functools.lru_cache(maxsize=None)
 def get_data(filename):
+    # returned bytes are immutable, so they can be shared between tests
     with open(os.path.join(os.path.dirname(__file__), "packs", filename), "rb") as f:
         return f.read()
 
 
+UPLOAD_PACK = get_data("upload_pack.bin")
+PACK_CACHE = get_data("pack_cache.bin")
+
+
 async def cache_pack(hash):
     pc = PackCache(hash)
     fakewrite = FakeStreamWriter()
-    fakeread = DataReader(get_data("upload_pack.bin"))
+    fakeread = DataReader(UPLOAD_PACK)
 
     async with pc.write_lock():
         await pc.cache_pack(fakeread.read)
@@ -30,7 +42,7 @@ async def cache_pack(hash):
     async with pc.read_lock():
         await pc.send_pack(fakewrite)
 
-    assert fakewrite.output == get_data("pack_cache.bin")
+    assert fakewrite.output == PACK_CACHE
     assert pc.exists()
     return pc
 
@@ -40,22 +52,67 @@ async def test_pack_cache_create(tmpworkdir, cdn_event_loop):
     pc = await cache_pack("1234")
     fakewrite = FakeStreamWriter()
     await pc.send_pack(fakewrite)
-    assert fakewrite.output == get_data("pack_cache.bin")
+    assert fakewrite.output == PACK_CACHE
+
+
+@pytest.mark.parametrize(
+    "new_loop,compress,use_sendfile",
+    [
+        (asyncio.new_event_loop, False, True),
+        (uvloop.new_event_loop, False, False),
+        (asyncio.new_event_loop, True, False),
+    ],
+    ids=["asyncio", "uvloop", "asyncio-compressed"],
+)
+def test_pack_cache_send_http(tmpworkdir, mocker, new_loop, compress, use_sendfile):
+    # serve through a real aiohttp writer, which is sent with sendfile on asyncio loops
+    sent = []
+    sendfile = PackCache._sendfile
+
+    async def spy_sendfile(self, writer, f):
+        sent.append(await sendfile(self, writer, f))
+        return sent[-1]
+
+    mocker.patch.object(PackCache, "_sendfile", spy_sendfile)
+
+    async def handler(request):
+        response = web.StreamResponse()
+        if compress:
+            response.enable_compression()
+        writer = await response.prepare(request)
+        await pc.send_pack(writer)
+        await response.write_eof()
+        return response
+
+    async def run():
+        app = web.Application()
+        app.router.add_get("/", handler)
+        async with TestClient(TestServer(app)) as client:
+            resp = await client.get("/")
+            assert await resp.read() == PACK_CACHE
+
+    # the loop is built here, pytest-asyncio only picks a policy since 0.23
+    loop = new_loop()
+    try:
+        asyncio.set_event_loop(loop)
+        pc = loop.run_until_complete(cache_pack("http"))
+        loop.run_until_complete(run())
+    finally:
+        asyncio.set_event_loop(None)
+        loop.close()
+    # the last send is the http one, cache_pack sent to a fake writer first
+    assert sent[-1] == (len(PACK_CACHE) if use_sendfile else 0)
 
 
 @pytest.mark.asyncio
 async def test_pack_cache_clean(tmpworkdir, cdn_event_loop):
-    # gitlab-ci filesystem has 1 second precision
-    sleep = 0
-    if "CI_JOB_TOKEN" in os.environ:
-        sleep = 1
-
     pc1 = await cache_pack("11111")
-    await asyncio.sleep(sleep)
     pc2 = await cache_pack("22222")
-    await asyncio.sleep(sleep)
     pc3 = await cache_pack("33333")
-    await asyncio.sleep(sleep)
+    # set increasing mtimes explicitly, some filesystems have 1 second precision
+    base = time() - 100
+    for i, pc in enumerate((pc1, pc2, pc3)):
+        os.utime(pc.filename, (base + i * 2, base + i * 2))
 
     # read "11111" so cleaner should remove "22222"
     await pc1.send_pack(FakeStreamWriter())
@@ -93,6 +150,55 @@ async def test_corrupt(tmpworkdir):
     assert not pc.exists()
 
 
+@pytest.mark.asyncio
+async def test_valid_xattr(tmpworkdir):
+    pc = await cache_pack("valid")
+    try:
+        valid_size = os.getxattr(pc.filename, VALID_XATTR)
+    except OSError:
+        pytest.skip("no xattr support on the test filesystem")
+    assert int(valid_size) == pc.size()
+    # the marked file is trusted without reading its content
+    with open(pc.filename, "r+b") as f:
+        f.seek(-4, os.SEEK_END)
+        f.write(b"XXXX")
+    assert pc.exists()
+
+
+@pytest.mark.asyncio
+async def test_truncated_after_valid(tmpworkdir):
+    pc = await cache_pack("truncated")
+    try:
+        os.getxattr(pc.filename, VALID_XATTR)
+    except OSError:
+        pytest.skip("no xattr support on the test filesystem")
+    os.truncate(pc.filename, pc.size() - 4)
+    assert not pc.exists()
+    os.truncate(pc.filename, 0)
+    assert not pc.exists()
+
+
+@pytest.mark.asyncio
+async def test_rewrite_drops_valid(tmpworkdir):
+    pc = await cache_pack("rewrite")
+    try:
+        os.getxattr(pc.filename, VALID_XATTR)
+    except OSError:
+        pytest.skip("no xattr support on the test filesystem")
+    fakeread = DataReader(UPLOAD_PACK)
+    marks = []
+
+    async def read(n):
+        # while the file is rewritten in place, it must not look complete
+        marks.append(VALID_XATTR in os.listxattr(pc.filename))
+        return await fakeread.read(n)
+
+    async with pc.write_lock():
+        await pc.cache_pack(read)
+    assert marks and not any(marks)
+    assert int(os.getxattr(pc.filename, VALID_XATTR)) == pc.size()
+
+
 @pytest.mark.asyncio
 async def test_pack_cache_error(tmpworkdir, cdn_event_loop):
     pc = PackCache("error")
@@ -1,8 +1,13 @@
 # Standard Library
+import asyncio
 import os
+import subprocess
+import sys
+from typing import Union
 
 # Third Party Libraries
 import pytest
+import pytest_asyncio
 from aiohttp.abc import AbstractStreamWriter
 
 from git_cdn.conftest import CREDS
@@ -14,7 +19,7 @@ from git_cdn.upload_pack_input_parser import UploadPackInputParser
 from git_cdn.upload_pack_input_parser_v2 import UploadPackInputParserV2
 from git_cdn.util import generate_url
 
-# pylint: disable=unused-argument,consider-using-f-string,protected-access
+# pylint: disable=unused-argument,consider-using-f-string,protected-access,redefined-outer-name
 
 CLONE_INPUT = (
     b"""0098want 4284b1521b200ba4934ee710a4a538549f1f0f97 multi_ack_detailed no-done """
@@ -44,32 +49,119 @@ INPUT_FETCH = (
     b"0032want 4284b1521b200ba4934ee710a4a538549f1f0f97\n0009done\n0000"
 )
 
+HUGE_INPUT_HEADER = (
+    b"0098want 4284b1521b200ba4934ee710a4a538549f1f0f97 multi_ack_detailed no-done "
+    b"side-band-64k thin-pack ofs-delta deepen-since deepen-not agent=git/2.15.1\n"
+)
+HUGE_INPUT_TRAILER = b"00000009done\n"
+# 2000 times the same want (simulating a repo with tons of branch on the same commit)
+HUGE_CLONE_INPUT = b"".join(
+    (
+        HUGE_INPUT_HEADER,
+        b"0032want 8f6312ec029e7290822bed826a05fd81e65b3b7c\n" * 2000,
+        HUGE_INPUT_TRAILER,
+    )
+)
+# 15000 times the same unknown want
+HUGE_UNKNOWN_INPUT = b"".join(
+    (
+        HUGE_INPUT_HEADER,
+        b"0032want 7f6312ec029e7290822bed826a05fd81e65b3b7c\n" * 15000,
+        HUGE_INPUT_TRAILER,
+    )
+)
+
+# same request with protocol v2
+HUGE_FETCH_INPUT = b"".join(
+    (
+        b"0011command=fetch0014agent=git/2.25.10001",
+        b"0032want 8f6312ec029e7290822bed826a05fd81e65b3b7c\n" * 2000,
+        b"0009done\n0000",
+    )
+)
+
+# parsed inputs are never modified by UploadPackHandler, so they are parsed once
+PARSED_CLONE = UploadPackInputParser(CLONE_INPUT)
+PARSED_SHALLOW = UploadPackInputParser(SHALLOW_INPUT)
+PARSED_SHALLOW_TRUNC = UploadPackInputParser(SHALLOW_INPUT_TRUNC)
+PARSED_FETCH = UploadPackInputParserV2(INPUT_FETCH)
+
+# the clone tests run the same body for each protocol version
+CLONE_REQUESTS = [
+    pytest.param(PARSED_CLONE, 1, id="v1"),
+    pytest.param(PARSED_FETCH, 2, id="v2"),
+]
+HUGE_CLONE_REQUESTS = [
+    pytest.param(UploadPackInputParser, HUGE_CLONE_INPUT, 1, id="v1"),
+    pytest.param(UploadPackInputParserV2, HUGE_FETCH_INPUT, 2, id="v2"),
+]
+
 MANIFEST_PATH = f"{GITLAB_REPO_TEST_GROUP}/test_git_cdn.git"
 
 PROTOCOL_VERSION = 1
 
 
 class FakeStreamWriter(AbstractStreamWriter):
-    """fake stream writer."""
+    """fake stream writer.
+    keep_ends: if set, only keep that many bytes at the start and at the end of the
+    output, for tests which only check its ends and don't need to hold whole packs
+    """
 
     buffer_size = 0
     output_size = 0
-    length = 0
-    _output = b""
-    _eof_written = False
+
+    def __init__(self, keep_ends=None):
+        self.length = 0
+        # chunks are only joined when the output is read, and the result is kept
+        self._chunks = []
+        self._eof_written = False
+        self._keep_ends = keep_ends
+        self._head = bytearray()
+        self._tail = bytearray()
+
+    def reset(self):
+        """empty the writer, to reuse it for another request"""
+        self.length = 0
+        self._chunks.clear()
+        self._eof_written = False
+        self._head.clear()
+        self._tail.clear()
+        # back to the class write, in case write_eof rebound it
+        self.__dict__.pop("write", None)
 
     @property
     def output(self):
         # assert self._eof_written
-        return self._output
-
-    async def write(self, chunk: bytes) -> None:
-        assert not self._eof_written
-        self._output += chunk
+        if self._keep_ends is not None:
+            trunc = b"...[trunc]..." if self.length > 2 * self._keep_ends else b""
+            return bytes(self._head) + trunc + bytes(self._tail)
+        if len(self._chunks) != 1 or not isinstance(self._chunks[0], bytes):
+            self._chunks = [b"".join(self._chunks)]
+        return self._chunks[0]
+
+    async def write(self, chunk: Union[bytes, bytearray, memoryview]) -> None:
         self.length += len(chunk)
+        if self._keep_ends is None:
+            # immutable buffers are kept as is, without copy,
+            # mutable ones are copied as the caller may reuse them
+            if not memoryview(chunk).readonly:
+                chunk = bytes(chunk)
+            self._chunks.append(chunk)
+            return
+        missing = self._keep_ends - len(self._head)
+        if missing > 0:
+            self._head += chunk[:missing]
+            chunk = chunk[missing:]
+        self._tail += chunk
+        del self._tail[: -self._keep_ends]
+
+    async def _write_after_eof(self, chunk) -> None:
+        raise AssertionError("write after eof")
 
     async def write_eof(self, chunk: bytes = b"") -> None:
         self._eof_written = True
+        # rebind instead of checking _eof_written on every write
+        self.write = self._write_after_eof  # pylint: disable=method-hidden
 
     async def drain(self) -> None:
         pass
@@ -84,127 +176,175 @@ class FakeStreamWriter(AbstractStreamWriter):
         pass
 
 
-def assert_upload_ok(data):
-    assert data.startswith(b"0008NAK\n")
-    assert data.endswith(b"0000")
-
-
-@pytest.mark.asyncio
-async def test_basic(tmpdir, cdn_event_loop):
+@pytest_asyncio.fixture
+def handler():
     writer = FakeStreamWriter()
     proc = UploadPackHandler(
         MANIFEST_PATH, writer, CREDS, GITSERVER_UPSTREAM, PROTOCOL_VERSION
     )
+    return proc, writer
+
+
+@pytest_asyncio.fixture(scope="session")
+def initial_commit_clone(tmp_path_factory):
+    """bare clone of the initial_commit branch only, fetched once per session"""
+    reference = tmp_path_factory.mktemp("reference") / "initial_commit.git"
+    # no event loop runs yet, a blocking call is fine; args are not parsed by a shell
+    subprocess.run(
+        [
+            "git",
+            "clone",
+            "--bare",
+            generate_url(GITSERVER_UPSTREAM, MANIFEST_PATH, CREDS),
+            str(reference),
+            "--single-branch",
+            "--branch",
+            "initial_commit",
+        ],
+        check=True,
+    )
+    return reference
+
+
+async def clone_initial_commit(reference, directory):
+    # local clone sharing the reference objects (via alternates), no network involved
+    proc = await asyncio.create_subprocess_exec(
+        "git",
+        "clone",
+        "--quiet",
+        "--bare",
+        "--shared",
+        str(reference),
+        str(directory),
+        stdout=asyncio.subprocess.DEVNULL,
+        stderr=asyncio.subprocess.PIPE,
+    )
+    _, stderr = await proc.communicate()
+    assert proc.returncode == 0, stderr.decode()
 
-    content = UploadPackInputParser(CLONE_INPUT)
-    await proc.run(content)
-    assert_upload_ok(writer.output)
 
+FAKE_UPLOAD_PACK = os.path.join(os.path.dirname(__file__), "fake_upload_pack.py")
+ROOT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
 
+
+@pytest_asyncio.fixture(
+    params=["fake", pytest.param("git", marks=[pytest.mark.slow, pytest.mark.network])]
+)
+def upload_pack_mode(request, monkeypatch, mocker):
+    """run against a fake git-upload-pack without repository, or the real git"""
+    if request.param == "fake":
+        tmpdir = request.getfixturevalue("tmpworkdir")
+        bindir = tmpdir / "bin"
+        bindir.mkdir()
+        script = bindir / "git-upload-pack"
+        script.write_text(
+            f'#!/bin/sh\nPYTHONPATH="{ROOT_DIR}" exec "{sys.executable}" '
+            f'"{FAKE_UPLOAD_PACK}"\n',
+            "utf-8",
+        )
+        script.chmod(0o755)
+        monkeypatch.setenv("PATH", f"{bindir}{os.pathsep}{os.environ['PATH']}")
+        mocker.patch.object(UploadPackHandler, "_ensure_input_wants_in_rcache")
+        mocker.patch.object(RepoCache, "exists", return_value=True)
+    else:
+        # the real git needs the repo, fetched once for the session
+        request.getfixturevalue("warm_workdir")
+    return request.param
+
+
+def assert_upload_ok(data, version=PROTOCOL_VERSION):
+    if version == 2:
+        assert data.startswith(b"000dpackfile\n")
+    else:
+        assert data.startswith(b"0008NAK\n")
+    assert data.endswith(b"0000")
+
+
+async def run_clone(proc, parsed_input, version):
+    proc.protocol_version = version
+    await proc.run(parsed_input)
+    assert_upload_ok(proc.writer.output, version)
+
+
+@pytest.mark.network
 @pytest.mark.asyncio
-async def test_huge(tmpdir, cdn_event_loop):
-    # we write 1000 times the same want (simulating a repo with tons of branch on the same commit)
-    HUGE_CLONE_INPUT = (
-        b"0098want 4284b1521b200ba4934ee710a4a538549f1f0f97 multi_ack_detailed no-done "
-        b"side-band-64k thin-pack ofs-delta deepen-since deepen-not agent=git/2.15.1\n"
-    )
-    HUGE_CLONE_INPUT += b"0032want 8f6312ec029e7290822bed826a05fd81e65b3b7c\n" * 2000
-    HUGE_CLONE_INPUT += b"00000009done\n"
-    writer = FakeStreamWriter()
-    proc = UploadPackHandler(
-        MANIFEST_PATH, writer, CREDS, GITSERVER_UPSTREAM, PROTOCOL_VERSION
-    )
-    content = UploadPackInputParser(HUGE_CLONE_INPUT)
-    await proc.run(content)
-    assert_upload_ok(writer.output)
+@pytest.mark.parametrize("parsed_input,version", CLONE_REQUESTS)
+async def test_basic(
+    tmpdir, cdn_event_loop, handler, warm_workdir, parsed_input, version
+):
+    proc, _ = handler
+    await run_clone(proc, parsed_input, version)
 
 
 @pytest.mark.asyncio
-async def test_huge2(tmpdir, cdn_event_loop):
-    # we write 15000 times the same unknow want
-    # git upload pack will close stdin before reading all the input,
-    # and write the error to stdout (occurs in production on mirrors repo)
-    HUGE_CLONE_INPUT = (
-        b"0098want 4284b1521b200ba4934ee710a4a538549f1f0f97 multi_ack_detailed no-done "
-        b"side-band-64k thin-pack ofs-delta deepen-since deepen-not agent=git/2.15.1\n"
-    )
-    HUGE_CLONE_INPUT += b"0032want 7f6312ec029e7290822bed826a05fd81e65b3b7c\n" * 15000
-    HUGE_CLONE_INPUT += b"00000009done\n"
-    writer = FakeStreamWriter()
+@pytest.mark.parametrize("parser_cls,data,version", HUGE_CLONE_REQUESTS)
+async def test_huge(
+    tmpdir, cdn_event_loop, upload_pack_mode, parser_cls, data, version
+):
+    writer = FakeStreamWriter(keep_ends=4096)
     proc = UploadPackHandler(
         MANIFEST_PATH, writer, CREDS, GITSERVER_UPSTREAM, PROTOCOL_VERSION
     )
-    content = UploadPackInputParser(HUGE_CLONE_INPUT)
+    parsed_input = parser_cls(data)
+    # each want is only forwarded once to git upload-pack
+    assert parsed_input.input.count(b"want ") == len(parsed_input.wants)
+    assert len(parsed_input.input) < len(data) // 100
+    await run_clone(proc, parsed_input, version)
+
+
+@pytest.mark.asyncio
+async def test_huge2(tmpdir, cdn_event_loop, upload_pack_mode, handler):
+    # duplicated wants are only forwarded once, and git upload pack
+    # writes the error to stdout (occurs in production on mirrors repo)
+    proc, writer = handler
+    content = UploadPackInputParser(HUGE_UNKNOWN_INPUT)
     await proc.run(content)
     data = writer.output
     assert b"not our ref" in data
 
 
+@pytest.mark.network
 @pytest.mark.asyncio
-async def test_fetch_needed(tmpdir, cdn_event_loop):
+async def test_fetch_needed(tmpdir, cdn_event_loop, handler, initial_commit_clone):
     workdir = tmpdir / "workdir"
-    writer = FakeStreamWriter()
-
-    proc = UploadPackHandler(
-        MANIFEST_PATH, writer, CREDS, GITSERVER_UPSTREAM, PROTOCOL_VERSION
-    )
-    # before run(), clone a small part of the repo (no need to bother for async)
+    proc, writer = handler
+    # before run(), clone a small part of the repo
     # to simulate the case where we need a fetch
-    os.system(
-        "git clone --bare {} {} --single-branch --branch initial_commit".format(
-            generate_url(proc.upstream, proc.path, proc.auth),
-            (workdir / "git" / MANIFEST_PATH),
-        )
-    )
+    await clone_initial_commit(initial_commit_clone, workdir / "git" / MANIFEST_PATH)
 
-    content = UploadPackInputParser(CLONE_INPUT)
-    await proc.run(content)
+    await proc.run(PARSED_CLONE)
     assert_upload_ok(writer.output)
 
 
+@pytest.mark.network
 @pytest.mark.asyncio
-async def test_shallow(tmpdir, cdn_event_loop):
-    writer = FakeStreamWriter()
-    proc = UploadPackHandler(
-        MANIFEST_PATH, writer, CREDS, GITSERVER_UPSTREAM, PROTOCOL_VERSION
-    )
+async def test_shallow(tmpdir, cdn_event_loop, handler, warm_workdir):
+    proc, writer = handler
 
-    content = UploadPackInputParser(SHALLOW_INPUT)
-    await proc.run(content)
+    await proc.run(PARSED_SHALLOW)
     full = writer.output
     assert full.startswith(b"0034shallow ")
     assert full.endswith(b"0000")
 
 
+@pytest.mark.network
 @pytest.mark.asyncio
-async def test_shallow_trunc(tmpdir, cdn_event_loop):
-    writer = FakeStreamWriter()
-    proc = UploadPackHandler(
-        MANIFEST_PATH,
-        writer,
-        CREDS,
-        GITSERVER_UPSTREAM,
-        PROTOCOL_VERSION,
-    )
+async def test_shallow_trunc(tmpdir, cdn_event_loop, handler, warm_workdir):
+    proc, writer = handler
 
-    content = UploadPackInputParser(SHALLOW_INPUT_TRUNC)
-    await proc.run(content)
+    await proc.run(PARSED_SHALLOW_TRUNC)
     assert writer.output == b"0000"
 
 
+@pytest.mark.network
 @pytest.mark.asyncio
-async def test_shallow_trunc2(tmpdir, cdn_event_loop):
-    writer = FakeStreamWriter()
+async def test_shallow_trunc2(tmpdir, cdn_event_loop, handler, warm_workdir):
     # make sur the cache is warm
-    proc = UploadPackHandler(
-        MANIFEST_PATH, writer, CREDS, GITSERVER_UPSTREAM, PROTOCOL_VERSION
-    )
-
-    content = UploadPackInputParser(SHALLOW_INPUT)
-    await proc.run(content)
+    proc, writer = handler
+    await proc.run(PARSED_SHALLOW)
     full = writer.output
     assert full
-    writer = FakeStreamWriter()
+    writer.reset()
     # give corrupted input to upload-pack
     proc = UploadPackHandler(
         MANIFEST_PATH,
@@ -221,16 +361,15 @@ async def test_shallow_trunc2(tmpdir, cdn_event_loop):
 @pytest.mark.parametrize(
     "clone_input",
     [
-        pytest.param(CLONE_INPUT[:-1] + b"A", id="detected by git"),
+        pytest.param(
+            CLONE_INPUT[:-1] + b"A", id="detected by git", marks=pytest.mark.network
+        ),
         pytest.param(CLONE_INPUT[:-1], id="detected by gitcdn input parser"),
     ],
 )
 @pytest.mark.asyncio
-async def test_wrong_input(tmpdir, cdn_event_loop, clone_input):
-    writer = FakeStreamWriter()
-    proc = UploadPackHandler(
-        MANIFEST_PATH, writer, CREDS, GITSERVER_UPSTREAM, PROTOCOL_VERSION
-    )
+async def test_wrong_input(tmpdir, cdn_event_loop, clone_input, handler, warm_workdir):
+    proc, writer = handler
 
     content = UploadPackInputParser(clone_input)
     await proc.run(content)
@@ -240,15 +379,15 @@ async def test_wrong_input(tmpdir, cdn_event_loop, clone_input):
 
 
 @pytest.mark.asyncio
-async def test_flush_input(tmpdir, cdn_event_loop):
-    writer = FakeStreamWriter()
-    proc = UploadPackHandler(
-        MANIFEST_PATH, writer, CREDS, GITSERVER_UPSTREAM, PROTOCOL_VERSION
-    )
+async def test_flush_input(tmpdir, cdn_event_loop, handler, mocker):
+    proc, writer = handler
+    spawn = mocker.patch("asyncio.create_subprocess_exec")
 
     content = UploadPackInputParser(b"0000")
     await proc.run(content)
     assert not writer.output
+    # nothing to send: neither git upload-pack nor a fetch must be spawned
+    spawn.assert_not_called()
 
 
 @pytest.mark.parametrize(
@@ -271,21 +410,26 @@ async def test_flush_input(tmpdir, cdn_event_loop):
     ],
     ids=["all refs in repo", "missing refs in repo"],
 )
+@pytest.mark.network
 @pytest.mark.asyncio
-async def test_missing_want(tmpdir, cdn_event_loop, ref, missing_ref):
-    writer = FakeStreamWriter()
-    proc = UploadPackHandler(
-        MANIFEST_PATH, writer, CREDS, GITSERVER_UPSTREAM, PROTOCOL_VERSION
-    )
+async def test_missing_want(
+    tmpdir, cdn_event_loop, ref, missing_ref, handler, warm_workdir
+):
+    proc, _ = handler
 
     proc.rcache = RepoCache(proc.path, proc.auth, proc.upstream)
 
-    await proc.rcache.update()
+    # the repo is fetched once for the session, the clone tests use the same one
+    if not proc.rcache.exists():
+        await proc.rcache.update()
     assert (await proc._missing_want(ref)) == missing_ref
 
 
+@pytest.mark.network
 @pytest.mark.asyncio
-async def test_ensure_input_wants_in_rcache(tmpdir, cdn_event_loop, mocker):
+async def test_ensure_input_wants_in_rcache(
+    tmpdir, cdn_event_loop, mocker, handler, initial_commit_clone
+):
     wants = [
         b"8f6312ec029e7290822bed826a05fd81e65b3b7c",
         b"4284b1521b200ba4934ee710a4a538549f1f0f97",
@@ -294,20 +438,12 @@ async def test_ensure_input_wants_in_rcache(tmpdir, cdn_event_loop, mocker):
     workdir = tmpdir / "workdir"
     path = "{}/git/{}".format(workdir, MANIFEST_PATH)
 
-    writer = FakeStreamWriter()
-    proc = UploadPackHandler(
-        MANIFEST_PATH, writer, CREDS, GITSERVER_UPSTREAM, PROTOCOL_VERSION
-    )
+    proc, _ = handler
     proc.rcache = RepoCache(path, proc.auth, proc.upstream)
 
-    # before run(), clone a small part of the repo (no need to bother for async)
+    # before run(), clone a small part of the repo
     # to simulate the case where we have not all refs
-    os.system(
-        "git clone --bare {} {} --single-branch --branch initial_commit".format(
-            generate_url(proc.upstream, proc.path, proc.auth),
-            (workdir / "git" / MANIFEST_PATH),
-        )
-    )
+    await clone_initial_commit(initial_commit_clone, workdir / "git" / MANIFEST_PATH)
 
     assert proc.rcache.exists()
     mock_missing_want = mocker.patch.object(proc, "_missing_want")
@@ -318,33 +454,26 @@ async def test_ensure_input_wants_in_rcache(tmpdir, cdn_event_loop, mocker):
     mock_update.assert_called_once()
 
 
+@pytest.mark.network
 @pytest.mark.asyncio
-async def test_unknown_want_cache(tmpdir, cdn_event_loop, mocker):
+async def test_unknown_want_cache(
+    tmpdir, cdn_event_loop, mocker, handler, initial_commit_clone
+):
     """tests that the 'uploadPack' method runs well
     when running '_execute' method with a repo with missing 'wants'
     """
-    parsed_input = UploadPackInputParserV2(INPUT_FETCH)
-
     workdir = tmpdir / "workdir"
     path = "{}/git/{}".format(workdir, MANIFEST_PATH)
 
-    writer = FakeStreamWriter()
-    proc = UploadPackHandler(
-        MANIFEST_PATH, writer, CREDS, GITSERVER_UPSTREAM, PROTOCOL_VERSION
-    )
+    proc, _ = handler
     proc.rcache = RepoCache(path, proc.auth, proc.upstream)
 
-    # before run(), clone a small part of the repo (no need to bother for async)
+    # before run(), clone a small part of the repo
     # to simulate the case where we have not all refs
-    os.system(
-        "git clone --bare {} {} --single-branch --branch initial_commit".format(
-            generate_url(proc.upstream, proc.path, proc.auth),
-            (workdir / "git" / MANIFEST_PATH),
-        )
-    )
+    await clone_initial_commit(initial_commit_clone, workdir / "git" / MANIFEST_PATH)
     assert proc.rcache.exists()
     try:
-        await proc._execute(parsed_input)
+        await proc._execute(PARSED_FETCH)
     except Exception:
         assert False
     assert True
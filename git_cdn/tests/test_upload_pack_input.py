@@ -1,11 +1,12 @@
 # Standard Library
-import json
-import os
+from pathlib import Path
 
 # Third Party Libraries
 import pytest
 import pytest_asyncio
+import ujson
 
+from git_cdn import git_cdn
 from git_cdn.upload_pack_input_parser import PacketLineParser
 from git_cdn.upload_pack_input_parser import UploadPackInputParser
 
@@ -28,18 +29,19 @@ INPUT_WITH_HAVE = (
     b"3ff9e763a0b11f0c51101b5cb204a12d233f5f65\n0009done\n"
 )
 
-with open(os.path.join(os.path.dirname(__file__), "upload_pack_inputs.json")) as f:
-    _upload_pack_inputs = json.load(f)
-
-TEST_BATCH_NUM = 1
+# encoded once at import, ujson parses the raw file content without a decode pass
+_upload_pack_inputs = tuple(
+    x.encode()
+    for x in ujson.loads(
+        Path(__file__).with_name("upload_pack_inputs.json").read_bytes()
+    )
+)
 
 
-@pytest_asyncio.fixture(params=range(len(_upload_pack_inputs) // TEST_BATCH_NUM))
-def upload_pack_inputs(request):
-    return [
-        x.encode()
-        for x in _upload_pack_inputs[request.param : request.param + TEST_BATCH_NUM]
-    ]
+# all the inputs in one batch, one test per input costs more in pytest than parsing
+@pytest_asyncio.fixture(scope="session")
+def upload_pack_inputs():
+    return _upload_pack_inputs
 
 
 def test_parse_pkt_all_input(upload_pack_inputs):
@@ -158,6 +160,15 @@ def test_parse_upload_pack_all_input(upload_pack_inputs):
         }
 
 
+def test_parse_upload_pack_input_duplicated_wants():
+    want = b"0032want 7bc80fd0ada7602695c7819e0105431e3262ad0c\n"
+    other = b"0032want 3ff9e763a0b11f0c51101b5cb204a12d233f5f65\n"
+    data = BASE_INPUT.replace(b"0000", want * 3 + other + want + other + b"0000")
+    parser = UploadPackInputParser(data)
+    assert parser.input == BASE_INPUT.replace(b"0000", other + b"0000")
+    assert parser.hash == UploadPackInputParser(parser.input).hash
+
+
 def test_parse_upload_pack_input_error():
     data = BASE_INPUT.replace(b"00a4", b"01a4")
     parser = UploadPackInputParser(data)
@@ -175,3 +186,49 @@ def test_parse_upload_pack_input_error():
 def test_parse_pkt_line_with_flush_before_header(i):
     parser = UploadPackInputParser(i)
     assert parser.parse_error is False
+
+
+@pytest.fixture
+def parse_cache(monkeypatch):
+    monkeypatch.setattr(git_cdn, "_parse_cache", git_cdn.OrderedDict())
+    return git_cdn._parse_cache  # pylint: disable=protected-access
+
+
+def test_parse_cache_hit(parse_cache):
+    parser = git_cdn.parse_upload_pack_input(UploadPackInputParser, BASE_INPUT)
+    assert parser.parse_error is False
+    assert git_cdn.parse_upload_pack_input(UploadPackInputParser, BASE_INPUT) is parser
+    other = git_cdn.parse_upload_pack_input(UploadPackInputParser, INPUT_WITH_HAVE)
+    assert other is not parser
+    assert len(parse_cache) == 2
+
+
+def test_parse_cache_size(parse_cache, monkeypatch):
+    monkeypatch.setattr(git_cdn, "PARSE_CACHE_SIZE", 1)
+    parser = git_cdn.parse_upload_pack_input(UploadPackInputParser, BASE_INPUT)
+    git_cdn.parse_upload_pack_input(UploadPackInputParser, INPUT_WITH_HAVE)
+    assert len(parse_cache) == 1
+    assert (
+        git_cdn.parse_upload_pack_input(UploadPackInputParser, BASE_INPUT) is not parser
+    )
+
+
+def test_parse_cache_big_input(parse_cache):
+    have = b"0032have 3ff9e763a0b11f0c51101b5cb204a12d233f5f65\n"
+    data = BASE_INPUT.replace(b"0009done", have * 100 + b"0009done")
+    assert len(data) > git_cdn.PARSE_CACHE_MAX_INPUT
+    parser = git_cdn.parse_upload_pack_input(UploadPackInputParser, data)
+    assert parser.parse_error is False
+    assert git_cdn.parse_upload_pack_input(UploadPackInputParser, data) is not parser
+    assert not parse_cache
+
+
+def test_parse_cache_error(parse_cache):
+    data = BASE_INPUT.replace(b"00a4", b"01a4")
+    parser = git_cdn.parse_upload_pack_input(UploadPackInputParser, data)
+    assert parser.parse_error is True
+    again = git_cdn.parse_upload_pack_input(UploadPackInputParser, data)
+    assert again is not parser
+    # each failing input gets its own random hash, never a pack cache hit
+    assert again.hash != parser.hash
+    assert not parse_cache
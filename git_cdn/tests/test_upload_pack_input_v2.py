@@ -8,26 +8,30 @@ from .any import ANYSTRING
 # pylint: disable = duplicate-code
 
 
-INPUT_FETCH = (
-    b"0011command=fetch0014agent=git/2.25.10001000dthin-pack000dofs-delta"
+# the fetch requests below share their command, args and wants
+FETCH_HEADER = b"0011command=fetch0014agent=git/2.25.10001"
+FETCH_ARGS = b"000dthin-pack000dofs-delta"
+FETCH_ALL_BASIC_ARGS = b"000dthin-pack000fno-progress000finclude-tag000dofs-delta"
+FETCH_WANTS = (
     b"0032want fcd062d2d06d00fc2a1bf3c8432effccbd186a08\n"
-    b"0032want 44667f210351a1a425a6463a204f32279d3b24f3\n0009done\n0000"
+    b"0032want 44667f210351a1a425a6463a204f32279d3b24f3\n"
 )
+FETCH_END = b"0009done\n0000"
+
+INPUT_FETCH = FETCH_HEADER + FETCH_ARGS + FETCH_WANTS + FETCH_END
 HASH_FETCH = "1e95621aee9bfc6f9d7eae5aaa9e31c6d8e482f7542b4ce1145e08d0328c9ea8"
 
 FETCH_WITH_HAVE = (
-    b"0011command=fetch0014agent=git/2.25.10001000dthin-pack000dofs-delta"
-    b"0032want fcd062d2d06d00fc2a1bf3c8432effccbd186a08\n"
-    b"0032want 44667f210351a1a425a6463a204f32279d3b24f3\n"
-    b"0032have 7bc80fd0ada7602695c7819e0105431e3262ad0c\n0009done\n0000"
+    FETCH_HEADER
+    + FETCH_ARGS
+    + FETCH_WANTS
+    + b"0032have 7bc80fd0ada7602695c7819e0105431e3262ad0c\n"
+    + FETCH_END
 )
 HASH_WITH_HAVE = "264287a5a069953bfa9e72256674b4a9c857d4908458473171ff7e2100f47acb"
 
 FETCH_WITH_ALL_BASIC_ARGS = (
-    b"0011command=fetch0014agent=git/2.25.10001"
-    b"000dthin-pack000fno-progress000finclude-tag000dofs-delta"
-    b"0032want fcd062d2d06d00fc2a1bf3c8432effccbd186a08\n"
-    b"0032want 44667f210351a1a425a6463a204f32279d3b24f3\n0009done\n0000"
+    FETCH_HEADER + FETCH_ALL_BASIC_ARGS + FETCH_WANTS + FETCH_END
 )
 HASH_WITH_ALL_BASIC_ARGS = (
     "0caff59b65c8f2bab7acf514dce99edb24bf49672d5eecce0642cd4d4bbe0960"
@@ -35,9 +39,9 @@ HASH_WITH_ALL_BASIC_ARGS = (
 
 FETCH_WITH_OBJECT_FORMAT = (
     b"0016object-format=sha10011command=fetch001eagent=git/2.29.2.windows.20001"
-    b"000dthin-pack000fno-progress000finclude-tag000dofs-delta"
-    b"0032want fcd062d2d06d00fc2a1bf3c8432effccbd186a08\n"
-    b"0032want 44667f210351a1a425a6463a204f32279d3b24f3\n0009done\n0000"
+    + FETCH_ALL_BASIC_ARGS
+    + FETCH_WANTS
+    + FETCH_END
 )
 HASH_WITH_OBJECT_FORMAT = (
     "2a46d98d04e4867c7e4d40efb7919ec117319c55ff2322bb9bb00daa44201089"
@@ -233,10 +237,11 @@ def test_parse_input_with_object_format():
 def test_parse_input_with_duplicated_wants():
     """duplicated haves or wants should not affect parser"""
     FETCH_WITH_DUPLICATED_WANTS = (
-        b"0011command=fetch0014agent=git/2.25.10001000dthin-pack000dofs-delta"
-        b"0032want fcd062d2d06d00fc2a1bf3c8432effccbd186a08\n"
-        b"0032want 44667f210351a1a425a6463a204f32279d3b24f3\n"
-        b"0032want fcd062d2d06d00fc2a1bf3c8432effccbd186a08\n0009done\n0000"
+        FETCH_HEADER
+        + FETCH_ARGS
+        + FETCH_WANTS
+        + b"0032want fcd062d2d06d00fc2a1bf3c8432effccbd186a08\n"
+        + FETCH_END
     )
 
     parser = UploadPackInputParserV2(FETCH_WITH_DUPLICATED_WANTS)
@@ -245,6 +250,9 @@ def test_parse_input_with_duplicated_wants():
         b"fcd062d2d06d00fc2a1bf3c8432effccbd186a08",
     }
     assert parser.hash == HASH_FETCH
+    # the duplicated want is not forwarded to git upload-pack
+    assert parser.input == INPUT_FETCH
+    assert UploadPackInputParserV2(parser.input).hash == parser.hash
 
 
 def test_parse_upload_pack_input_error():
@@ -20,6 +20,10 @@ from git_cdn.util import ensure_proc_terminated
 
 log = getLogger()
 
+# max size of the reads of git upload-pack output: the pipe transport reads up to
+# 256KiB at once, smaller reads split its data into more writes to the client
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", str(256 * 1024)))
+
 cache_cleaner = PackCacheCleaner()
 
 
@@ -122,7 +126,6 @@ class UploadPackHandler:
         await self.writer.write(pkt)
 
     async def _flush_to_writer(self, read_func):
-        CHUNK_SIZE = int(os.environ.get("CHUNK_SIZE", 32 * 1024))
         while True:
             chunk = await read_func(CHUNK_SIZE)
             if not chunk:
@@ -1,13 +1,14 @@
 # Standard Library
 import hashlib
-import os
 import uuid
 
 from structlog import getLogger
 
 # Third Party Libraries
+from git_cdn import util
 from git_cdn.packet_line import FLUSH_PKT
 from git_cdn.packet_line import PacketLineParser
+from git_cdn.packet_line import drop_spans
 
 log = getLogger()
 
@@ -72,21 +73,19 @@ class UploadPackInputParser:
             self.parse_lists()
             if b"filter" in self.caps:
                 self.filter = True
-            computed_hash = hashlib.sha256()
-            computed_hash.update(b"caps")
-            for i in sorted(self.caps):
-                computed_hash.update(i)
-            computed_hash.update(b"haves")
-            for i in sorted(self.haves):
-                computed_hash.update(i)
-            computed_hash.update(b"wants")
-            for i in sorted(self.wants):
-                computed_hash.update(i)
-            for i in sorted(self.depth_lines):
-                computed_hash.update(i)
+            # hash the canonical form in one call, same digest as one update per item
+            canonical = [
+                b"caps",
+                *sorted(self.caps),
+                b"haves",
+                *sorted(self.haves),
+                b"wants",
+                *sorted(self.wants),
+                *sorted(self.depth_lines),
+            ]
             if self.done:
-                computed_hash.update(b"done")
-            self.hash = computed_hash.hexdigest()
+                canonical.append(b"done")
+            self.hash = hashlib.sha256(b"".join(canonical)).hexdigest()
             self.as_dict = {
                 # decoded data to be stored in logstash for analysis
                 "haves": b" ".join([x[:8] for x in self.haves]).decode(),
@@ -136,22 +135,32 @@ class UploadPackInputParser:
             self.caps[k] = v
 
     def parse_lists(self):
+        # spans of the input holding a want already seen
+        duplicates = []
+        end = self.parser.i
         for pkt in self.parser:
+            start, end = end, self.parser.i
             if pkt == FLUSH_PKT:
                 continue
 
             line = pkt.rstrip(b"\n")
             line_split = line.split(b" ")
-            if line_split[0].lower() == b"want":
+            # lower the keyword only once, this loop runs for every want and have
+            keyword = line_split[0].lower()
+            if keyword == b"want":
+                if line_split[1] in self.wants:
+                    duplicates.append((start, end))
                 self.wants.add(line_split[1])
-            if line_split[0].lower() == b"done":
+            elif keyword == b"done":
                 self.done = True
-            if line_split[0].lower() == b"have":
+            elif keyword == b"have":
                 self.haves.add(line_split[1])
-            if b"deep" in line_split[0].lower():
+            elif b"deep" in keyword:
                 self.depth = True
                 self.depth_lines.append(line)
 
+        self.input = drop_spans(self.input, duplicates)
+
     def __hash__(self):
         return int(self.hash, 16)
 
@@ -180,11 +189,9 @@ class UploadPackInputParser:
             return False
         if self.filter:
             return False
-        multi = os.getenv("PACK_CACHE_MULTI", "false").lower() in ["true", "1"]
-        if not multi and len(self.wants) > 1:
+        if not util.PACK_CACHE_MULTI and len(self.wants) > 1:
             return False
-        depth = os.getenv("PACK_CACHE_DEPTH", "false").lower() in ["true", "1"]
-        if not depth and self.depth:
+        if not util.PACK_CACHE_DEPTH and self.depth:
             return False
         return True
         # pylint: enable=duplicate-code
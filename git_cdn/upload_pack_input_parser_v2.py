@@ -1,15 +1,16 @@
 # Standard Library
 import hashlib
-import os
 import uuid
 
 from structlog import getLogger
 
 # Third Party Libraries
+from git_cdn import util
 from git_cdn.packet_line import DELIM_PKT
 from git_cdn.packet_line import FLUSH_PKT
 from git_cdn.packet_line import RESPONSE_END_PKT
 from git_cdn.packet_line import PacketLineParser
+from git_cdn.packet_line import drop_spans
 
 log = getLogger()
 
@@ -142,24 +143,21 @@ class UploadPackInputParserV2:
 
     def hash_update(self):
         # pylint: disable=duplicate-code
-        computed_hash = hashlib.sha256()
-        computed_hash.update(b"caps")
-        for i in sorted(self.caps):
-            computed_hash.update(i)
-        computed_hash.update(b"haves")
-        for i in sorted(self.haves):
-            computed_hash.update(i)
-        computed_hash.update(b"wants")
-        for i in sorted(self.wants):
-            computed_hash.update(i)
-        computed_hash.update(b"args")
-        for i in sorted(self.args):
-            computed_hash.update(i)
-        for i in sorted(self.depth_lines):
-            computed_hash.update(i)
+        # hash the canonical form in one call, same digest as one update per item
+        canonical = [
+            b"caps",
+            *sorted(self.caps),
+            b"haves",
+            *sorted(self.haves),
+            b"wants",
+            *sorted(self.wants),
+            b"args",
+            *sorted(self.args),
+            *sorted(self.depth_lines),
+        ]
         if self.done:
-            computed_hash.update(b"done")
-        self.hash = computed_hash.hexdigest()
+            canonical.append(b"done")
+        self.hash = hashlib.sha256(b"".join(canonical)).hexdigest()
         # pylint: enable=duplicate-code
 
     def parse_caps(self):
@@ -182,10 +180,9 @@ class UploadPackInputParserV2:
 
             line = pkt.rstrip(b"\n")
             line = line.lower()
-            if b"=" in line:
-                k, v = line.split(b"=", 1)
-            else:
-                k, v = line, True
+            k, sep, v = line.partition(b"=")
+            if not sep:
+                v = True
 
             # parsing caps and command at the same time
             # because some clients send the command in the middle of the caps
@@ -205,7 +202,10 @@ class UploadPackInputParserV2:
 
     def parse_args(self):
         self.args = {}
+        # spans of the input holding a want already seen
+        duplicates = []
 
+        start = self.parser.i
         pkt = next(self.parser)
         while pkt != FLUSH_PKT:
             if pkt in (DELIM_PKT, RESPONSE_END_PKT):
@@ -213,12 +213,14 @@ class UploadPackInputParserV2:
 
             line = pkt.rstrip(b"\n")
             line = line.lower()
-            if b" " in line:
-                k, v = line.split(b" ", 1)
-
+            # a single C level scan for the separator, instead of a test then a split
+            k, sep, v = line.partition(b" ")
+            if sep:
                 if k == b"have":
                     self.haves.add(v)
                 elif k == b"want":
+                    if v in self.wants:
+                        duplicates.append((start, self.parser.i))
                     self.wants.add(v)
                 elif b"deep" in k:
                     self.depth = True
@@ -226,7 +228,6 @@ class UploadPackInputParserV2:
                 else:
                     self.args[k] = v
             else:
-                k = line
                 self.args[k] = True
 
                 if k == b"done":
@@ -234,8 +235,11 @@ class UploadPackInputParserV2:
 
             if k not in ARGS:
                 log.warning(f"unknown arg: {k!r}")
+            start = self.parser.i
             pkt = next(self.parser)
 
+        self.input = drop_spans(self.input, duplicates)
+
     def __hash__(self):
         return int(self.hash, 16)
 
@@ -268,11 +272,9 @@ class UploadPackInputParserV2:
             return False
         if self.filter:
             return False
-        multi = os.getenv("PACK_CACHE_MULTI", "false").lower() in ["true", "1"]
-        if not multi and len(self.wants) > 1:
+        if not util.PACK_CACHE_MULTI and len(self.wants) > 1:
             return False
-        depth = os.getenv("PACK_CACHE_DEPTH", "false").lower() in ["true", "1"]
-        if not depth and self.depth:
+        if not util.PACK_CACHE_DEPTH and self.depth:
             return False
         return True
         # pylint: enable=duplicate-code
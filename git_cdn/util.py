@@ -1,8 +1,10 @@
 # Standard Library
 import asyncio
 import base64
+import functools
 import os
 import re
+import sys
 import urllib
 from asyncio.subprocess import Process
 from importlib.metadata import PackageNotFoundError
@@ -12,10 +14,19 @@ from importlib.metadata import version
 from aiohttp.web_exceptions import HTTPBadRequest
 from structlog import getLogger
 
+if sys.version_info >= (3, 11):
+    from asyncio import timeout as async_timeout
+else:
+    # installed by aiohttp on python < 3.11
+    from async_timeout import timeout as async_timeout
+
 WORKDIR = os.path.expanduser(os.getenv("WORKING_DIRECTORY", "/tmp/workdir"))
 GITLFS_OBJECT_RE = re.compile(r"(?P<path>.*\.git)/gitlab-lfs/objects/[0-9a-f]{64}$")
 GIT_PROCESS_WAIT_TIMEOUT = int(os.getenv("GIT_PROCESS_WAIT_TIMEOUT", "2"))
 KILLED_PROCESS_TIMEOUT = 30
+# also cache the packs of multiple refs clones, or of clones with depth
+PACK_CACHE_MULTI = os.getenv("PACK_CACHE_MULTI", "false").lower() in ["true", "1"]
+PACK_CACHE_DEPTH = os.getenv("PACK_CACHE_DEPTH", "false").lower() in ["true", "1"]
 
 try:
     GITCDN_VERSION = version("git_cdn")
@@ -58,14 +69,21 @@ def find_gitpath(path):
     return None
 
 
-def get_subdir(subpath):
-    """find or create the working directory of the repository path"""
-    d = os.path.join(WORKDIR, subpath)
-    if not os.path.isdir(d):
-        os.makedirs(d, exist_ok=True)
+@functools.lru_cache(maxsize=512)
+def _make_subdir(workdir, subpath):
+    d = os.path.join(workdir, subpath)
+    os.makedirs(d, exist_ok=True)
     return d
 
 
+def get_subdir(subpath):
+    """find or create the working directory of the repository path
+    the directory is only created once per process, the locks taken in it
+    recreate their parent directory if the cache cleaner removed it
+    """
+    return _make_subdir(WORKDIR, subpath)
+
+
 def get_bundle_paths(git_path):
     """compute the locks and bundle paths"""
     git_path = git_path.rstrip("/")
@@ -134,7 +152,9 @@ def log_proc_if_error(proc: Process, cmd: str):
 async def wait_proc(proc: Process, cmd: str, timeout: int):
     try:
         if proc.returncode is None:
-            await asyncio.wait_for(proc.wait(), timeout=timeout)
+            # no helper task, unlike asyncio.wait_for before python 3.12
+            async with async_timeout(timeout):
+                await proc.wait()
 
         log_proc_if_error(proc, cmd)
         return True